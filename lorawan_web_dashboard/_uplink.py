@@ -0,0 +1,96 @@
+"""
+Water Tank Monitor - ChirpStack uplink decoding
+Per-message parse path for the web server, kept free of Flask/MQTT code
+
+Plain Python so it runs as-is; on the Pi it can be compiled in place for
+native speed with:
+
+    cythonize -i _uplink.py
+"""
+
+import logging
+import time
+
+import msgspec
+import pybase64
+
+# ChirpStack uplink schema - only the fields we read are decoded,
+# everything else in the event is skipped by the parser
+class RxInfo(msgspec.Struct):
+    rssi: int = 0
+    snr: float = 0.0
+
+class Uplink(msgspec.Struct):
+    data: str = ""
+    fCnt: int = 0
+    rxInfo: list[RxInfo] = []
+
+_DEC = msgspec.json.Decoder(Uplink)
+
+# SIMD base64 decoder (NEON on the Pi), bound once to skip attribute lookups
+_b64 = pybase64.b64decode
+
+# Child of the web server's queued logger
+logger = logging.getLogger("lorawan_web.uplink")
+
+# The sensor firmware always sends exactly 2 bytes. Set to True for
+# firmware that sends longer payloads to use the length-checked decoder.
+GENERIC_PAYLOAD = False
+
+def decode_payload(data_string):
+    """
+    Decode the fixed 2-byte base64 payload from ChirpStack
+    Raises on a short or malformed payload, callers handle the error
+    """
+    # 4 base64 chars decode to the 2 level bytes (plus padding)
+    b = _b64(data_string[:4], validate=False)
+    return ((b[0] << 8) | b[1]) / 100.0
+
+def decode_payload_generic(data_string):
+    """Decode base64 payload of any length from ChirpStack"""
+    # The first 4 base64 chars cover the first 3 payload bytes,
+    # so only decode those
+    if len(data_string) < 4:
+        return None
+    head = _b64(data_string[:4], validate=False)
+    
+    # Invalid characters are discarded, so check we still got 2 bytes
+    if len(head) < 2:
+        return None
+    
+    # Big-endian unsigned short
+    return int.from_bytes(head[:2], 'big') / 100.0
+
+_decode_level = decode_payload_generic if GENERIC_PAYLOAD else decode_payload
+
+def decode_and_pack(payload_bytes):
+    """
+    Decode a raw uplink event into
+    (tank_level, rssi, snr, frame_count, timestamp_ns)
+
+    Returns None if the payload carries no tank level.
+    Raises msgspec.DecodeError for malformed JSON.
+    """
+    uplink = _DEC.decode(payload_bytes)
+    
+    # MAC-only frames carry no FRMPayload, nothing to decode
+    if not uplink.data:
+        return None
+    
+    try:
+        tank_level = _decode_level(uplink.data)
+    except (ValueError, IndexError) as e:
+        logger.error(f"Error decoding payload: {e}")
+        return None
+    if tank_level is None:
+        return None
+    
+    # Get signal info
+    if uplink.rxInfo:
+        rssi = uplink.rxInfo[0].rssi
+        snr = uplink.rxInfo[0].snr
+    else:
+        rssi = 0
+        snr = 0.0
+    
+    return tank_level, rssi, snr, uplink.fCnt, time.time_ns()
@@ -0,0 +1,22 @@
+"""
+Water Tank Monitor - gunicorn settings
+Loaded automatically when gunicorn is started from this directory:
+
+    gunicorn wsgi:application
+"""
+
+bind = "0.0.0.0:5002"
+
+# Tank data lives in process memory and the single MQTT subscriber uses a
+# fixed client_id, so exactly one worker process; concurrency comes from
+# its thread pool
+workers = 1
+worker_class = "gthread"
+threads = 8
+
+def on_starting(server):
+    """Refuse to start with more than one worker (e.g. '-w 2' on the CLI)"""
+    if server.cfg.workers != 1:
+        raise SystemExit(
+            f"lorawan_web_server must run with exactly 1 worker, got {server.cfg.workers}"
+        )
@@ -4,129 +4,206 @@ Water Tank Monitor - LoRaWAN Web Server
 Subscribes to ChirpStack MQTT and displays data on webpage
 """
 
-from flask import Flask, render_template, jsonify
+from flask import Flask, render_template, Response
 import paho.mqtt.client as mqtt
-import json
-import struct
-import base64
+import numpy as np
+import orjson
 from datetime import datetime
 import threading
+import time
+import socket
+import sys
+import atexit
+import logging
+import logging.handlers
+import queue
+
+from _uplink import decode_and_pack
 
 app = Flask(__name__)
 
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Queue records unformatted so the listener thread does the formatting"""
+    def prepare(self, record):
+        # Same-process queue, so the record (and its args) need no pickling
+        return record
+
+# Per-message output goes through a queue so the MQTT callback never
+# blocks on stdout or spends time formatting
+_console_q = queue.SimpleQueue()
+logger = logging.getLogger("lorawan_web")
+logger.setLevel(logging.INFO)
+logger.addHandler(_DeferredQueueHandler(_console_q))
+logger.propagate = False
+_console_listener = logging.handlers.QueueListener(_console_q, logging.StreamHandler(sys.stdout))
+_console_listener.start()
+atexit.register(_console_listener.stop)
+
 # MQTT Configuration
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
-MQTT_TOPIC = "application/+/device/+/event/up"
 DEVICE_EUI = "a84041d111896c86"
+# Subscribe to our device only - the broker filters out other devices
+MQTT_TOPIC = f"application/+/device/{DEVICE_EUI}/event/up"
+# Kernel receive buffer for the MQTT socket, absorbs uplink bursts
+MQTT_RCVBUF = 1 << 20
 
 # Current data storage
 current_data = {
     'tank_level': 0.0,
-    'voltage': 0.0,
     'rssi': 0,
     'snr': 0,
-    'timestamp': None,
+    'timestamp_ns': None,  # time.time_ns() of the last uplink
     'status': 'waiting',
-    'frame_count': 0,
-    'history': []
+    'frame_count': 0
 }
 
-def decode_payload(data_string):
-    """Decode base64 payload from ChirpStack"""
-    try:
-        # Decode from base64
-        data_bytes = base64.b64decode(data_string)
-        
-        if len(data_bytes) >= 2:
-            # Unpack as big-endian unsigned short
-            level_scaled = struct.unpack('>H', data_bytes[:2])[0]
-            tank_level = level_scaled / 100.0
-            return tank_level
-        else:
-            return None
-    except Exception as e:
-        print(f"Error decoding payload: {e}")
-        return None
+# History ring buffer (last 100 readings), one array per field
+_HIST_N = 100
+_hist_level = np.zeros(_HIST_N, np.float32)
+_hist_rssi = np.zeros(_HIST_N, np.int16)
+_hist_snr = np.zeros(_HIST_N, np.float32)
+_hist_ts = np.zeros(_HIST_N, np.int64)  # ns since epoch
+_hist_idx = 0
+_hist_full = False
+
+def _hist_ordered(arr):
+    """Return the ring buffer contents oldest first"""
+    if _hist_full:
+        return np.concatenate((arr[_hist_idx:], arr[:_hist_idx]))
+    return arr[:_hist_idx]
+
+def history_columns():
+    """History as a dict of column arrays, oldest first"""
+    return {
+        'tank_level': _hist_ordered(_hist_level),
+        'rssi': _hist_ordered(_hist_rssi),
+        'snr': _hist_ordered(_hist_snr),
+        'timestamp': _hist_ordered(_hist_ts)
+    }
+
+def _iso(ns):
+    """Format a time.time_ns() value as a local ISO 8601 string"""
+    return datetime.fromtimestamp(ns / 1e9).isoformat()
+
+class _LocalTime:
+    """time.time_ns() value that is only formatted when logged"""
+    __slots__ = ('ns',)
+    
+    def __init__(self, ns):
+        self.ns = ns
+    
+    def __str__(self):
+        return time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.ns / 1e9))
+
+# Serialized API responses, rebuilt only when new data arrives
+_tank_data_json = b''
+_history_json = b''
+
+# Guards current_data, the history ring and the cached responses
+_lock = threading.Lock()
+
+def _refresh_cache():
+    """Re-serialize the /api/tank-data and /api/history responses
+
+    Caller must hold _lock.
+    """
+    global _tank_data_json, _history_json
+    history = history_columns()
+    data = dict(current_data, history=history)
+    ts_ns = data.pop('timestamp_ns')
+    data['timestamp'] = _iso(ts_ns) if ts_ns is not None else None
+    
+    # Sensor voltage is derived from the level (reverse of the encoding)
+    # tank_level = ((voltage - 0.5) / (1.44 - 0.5)) * 100
+    # voltage = (tank_level / 100) * (1.44 - 0.5) + 0.5
+    data['voltage'] = data['tank_level'] * 0.0094 + 0.5 if ts_ns is not None else 0.0
+    
+    _tank_data_json = orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY)
+    _history_json = orjson.dumps(history, option=orjson.OPT_SERIALIZE_NUMPY)
+
+with _lock:
+    _refresh_cache()
+
+def on_socket_open(client, userdata, sock):
+    """Tune every new MQTT socket, including those opened on reconnect"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MQTT_RCVBUF)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
 def on_connect(client, userdata, flags, rc):
     """Callback when connected to MQTT broker"""
     if rc == 0:
         print("Connected to MQTT broker successfully!")
-        client.subscribe(MQTT_TOPIC)
+        client.subscribe(MQTT_TOPIC, qos=0)
         print(f"Subscribed to: {MQTT_TOPIC}")
     else:
         print(f"Connection failed with code {rc}")
 
+def _update(tank_level, rssi, snr, f_cnt, ts_ns):
+    """Store a decoded reading in current_data and the history ring"""
+    global _hist_idx, _hist_full
+    new_data = {
+        'tank_level': tank_level,
+        'rssi': rssi,
+        'snr': snr,
+        'timestamp_ns': ts_ns,
+        'status': 'online',
+        'frame_count': f_cnt
+    }
+    
+    # Apply the whole update at once so readers never see a mix of
+    # old and new fields
+    with _lock:
+        current_data.update(new_data)
+        
+        # Add to history, overwriting the oldest entry once full
+        i = _hist_idx
+        _hist_level[i] = tank_level
+        _hist_rssi[i] = rssi
+        _hist_snr[i] = snr
+        _hist_ts[i] = ts_ns
+        _hist_idx = (i + 1) % _HIST_N
+        if _hist_idx == 0:
+            _hist_full = True
+        
+        _refresh_cache()
+
 def on_message(client, userdata, msg):
     """Callback when MQTT message received"""
     try:
-        payload = json.loads(msg.payload.decode())
-        
-        # Extract device info
-        dev_eui = payload.get('deviceInfo', {}).get('devEui', '').lower()
-        
-        # Only process our device
-        if dev_eui != DEVICE_EUI:
+        reading = decode_and_pack(msg.payload)
+        if reading is None:
             return
         
-        # Extract data
-        data_b64 = payload.get('data', '')
-        tank_level = decode_payload(data_b64)
-        
-        if tank_level is None:
-            return
-        
-        # Get signal info
-        rx_info = payload.get('rxInfo', [{}])[0]
-        rssi = rx_info.get('rssi', 0)
-        snr = rx_info.get('snr', 0)
-        
-        # Get frame counter
-        f_cnt = payload.get('fCnt', 0)
-        
-        # Calculate voltage from tank level (reverse of encoding)
-        # tank_level = ((voltage - 0.5) / (1.44 - 0.5)) * 100
-        # voltage = (tank_level / 100) * (1.44 - 0.5) + 0.5
-        voltage = (tank_level / 100.0) * 0.94 + 0.5
+        tank_level, rssi, snr, f_cnt, ts_ns = reading
+        _update(tank_level, rssi, snr, f_cnt, ts_ns)
         
-        # Update current data
-        current_data['tank_level'] = tank_level
-        current_data['voltage'] = voltage
-        current_data['rssi'] = rssi
-        current_data['snr'] = snr
-        current_data['timestamp'] = datetime.now().isoformat()
-        current_data['status'] = 'online'
-        current_data['frame_count'] = f_cnt
-        
-        # Add to history (keep last 100)
-        current_data['history'].append({
-            'tank_level': tank_level,
-            'voltage': voltage,
-            'rssi': rssi,
-            'snr': snr,
-            'timestamp': current_data['timestamp']
-        })
-        
-        if len(current_data['history']) > 100:
-            current_data['history'] = current_data['history'][-100:]
-        
-        print(f"[{current_data['timestamp']}] Tank: {tank_level:.1f}%, RSSI: {rssi} dBm, SNR: {snr} dB, Frame: {f_cnt}")
+        logger.info("[%s] Tank: %.1f%%, RSSI: %s dBm, SNR: %s dB, Frame: %s",
+                    _LocalTime(ts_ns), tank_level, rssi, snr, f_cnt)
         
     except Exception as e:
-        print(f"Error processing message: {e}")
+        logger.error(f"Error processing message: {e}")
 
-def mqtt_thread():
-    """Run MQTT client in background thread"""
-    client = mqtt.Client(client_id="lorawan_web_monitor")
-    client.on_connect = on_connect
-    client.on_message = on_message
-    
-    try:
-        client.connect(MQTT_BROKER, MQTT_PORT, 60)
-        client.loop_forever()
-    except Exception as e:
-        print(f"MQTT Error: {e}")
+_mqtt_client = None
+_mqtt_start_lock = threading.Lock()
+
+def start_mqtt():
+    """Connect to the broker and start paho's network thread (once per process)"""
+    global _mqtt_client
+    with _mqtt_start_lock:
+        if _mqtt_client is not None:
+            return
+        
+        client = mqtt.Client(client_id="lorawan_web_monitor")
+        client.on_socket_open = on_socket_open
+        client.on_connect = on_connect
+        client.on_message = on_message
+        _mqtt_client = client
+        
+        # connect_async lets paho's thread keep retrying until the broker
+        # is up, e.g. when the dashboard starts before mosquitto at boot
+        client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+        client.loop_start()
 
 @app.route('/')
 def index():
@@ -136,12 +213,13 @@ def index():
 @app.route('/api/tank-data')
 def tank_data():
     """API endpoint to retrieve current tank data"""
-    return jsonify(current_data)
+    # bytes are immutable, so no copy or lock is needed to serve them
+    return Response(_tank_data_json, mimetype='application/json')
 
 @app.route('/api/history')
 def get_history():
     """Get historical data"""
-    return jsonify(current_data.get('history', []))
+    return Response(_history_json, mimetype='application/json')
 
 if __name__ == '__main__':
     print("=" * 50)
@@ -149,13 +227,12 @@ if __name__ == '__main__':
     print("=" * 50)
     print("Starting MQTT subscriber thread...")
     
-    # Start MQTT in background thread
-    mqtt_bg = threading.Thread(target=mqtt_thread, daemon=True)
-    mqtt_bg.start()
+    # Start MQTT (paho runs its network loop in a background thread)
+    start_mqtt()
     
     print("Starting web server...")
     print(f"Access dashboard at: http://192.168.55.192:5002")
     print("=" * 50)
     
-    # Run Flask server
+    # Run Flask development server (see wsgi.py for production)
     app.run(host='0.0.0.0', port=5002, debug=False)
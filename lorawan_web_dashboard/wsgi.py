@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+"""
+Water Tank Monitor - WSGI entry point
+Serves the dashboard with gunicorn instead of the Flask dev server
+
+Tank data is held in process memory, so run a single worker process and
+get concurrency from its thread pool. gunicorn.conf.py sets this up and
+refuses to start with more than one worker:
+
+    gunicorn wsgi:application
+"""
+
+from lorawan_web_server import app, start_mqtt
+
+# This (single) worker process is the only MQTT subscriber
+start_mqtt()
+
+application = app
@@ -7,19 +7,75 @@ Run on Raspberry Pi ChirpStack server
 """
 
 import paho.mqtt.client as mqtt
-import json
-import struct
-from datetime import datetime
+import msgspec
+import pybase64
+import time
 import sys
+import socket
+import atexit
+import threading
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+# Per-message output goes through a queue so the MQTT callback never
+# blocks on stdout
+_console_q = queue.SimpleQueue()
+logger = logging.getLogger("monitor_display")
+logger.setLevel(logging.INFO)
+logger.addHandler(logging.handlers.QueueHandler(_console_q))
+logger.propagate = False
+_console_listener = logging.handlers.QueueListener(_console_q, logging.StreamHandler(sys.stdout))
+
+# Separator lines for the per-message display block
+_SEP = "=" * 60
+_RULE = "-" * 60
 
 # MQTT Configuration
 MQTT_BROKER = "localhost"
 MQTT_PORT = 1883
-MQTT_TOPIC = "application/+/device/+/event/up"
 
 # Device EUI (from your configuration)
 DEVICE_EUI = "a84041d111896c86"
 
+# Subscribe to our device only - the broker filters out other devices
+MQTT_TOPIC = f"application/+/device/{DEVICE_EUI}/event/up"
+
+# Kernel receive buffer for the MQTT socket, absorbs uplink bursts
+MQTT_RCVBUF = 1 << 20
+
+# ChirpStack uplink schema - only the fields we display are decoded
+class DeviceInfo(msgspec.Struct):
+    devEui: str = ""
+
+class RxInfo(msgspec.Struct):
+    rssi: Optional[int] = None
+    snr: Optional[float] = None
+
+class Uplink(msgspec.Struct):
+    devEUI: str = ""  # ChirpStack v3 field name
+    deviceInfo: DeviceInfo = msgspec.field(default_factory=DeviceInfo)
+    data: str = ""
+    fPort: Optional[int] = None
+    fCnt: Optional[int] = None
+    rxInfo: list[RxInfo] = []
+
+_DEC = msgspec.json.Decoder(Uplink)
+
+# SIMD base64 decoder (NEON on the Pi), bound once to skip attribute lookups
+_b64 = pybase64.b64decode
+
+# CSV log - the file is opened once and writes are flushed in batches
+LOG_FILE = '/home/glen/water_tank_log.csv'
+LOG_FLUSH_EVERY = 10      # writes
+LOG_FLUSH_INTERVAL = 5.0  # seconds
+
+_log_fh = None
+_log_lock = threading.Lock()
+_log_pending = 0
+_log_timer = None
+
 def decode_payload(data_string):
     """
     Decode the water tank sensor payload
@@ -29,27 +85,33 @@ def decode_payload(data_string):
     ChirpStack sends data as base64, so we need to decode it first
     """
     try:
-        import base64
+        # 2 bytes is 4 chars in both base64 and hex
+        if len(data_string) < 4:
+            return None
         
         # Check if it looks like base64 (contains = or is not valid hex)
         if '=' in data_string or not all(c in '0123456789ABCDEFabcdef' for c in data_string):
-            # Decode from base64
-            data_bytes = base64.b64decode(data_string)
+            # Decode from base64 - the first 4 chars cover the first 3 bytes
+            head = _b64(data_string[:4], validate=False)
         else:
             # Try as hex
-            data_bytes = bytes.fromhex(data_string)
+            head = bytes.fromhex(data_string[:4])
         
-        if len(data_bytes) >= 2:
-            # Unpack as big-endian unsigned short
-            level_scaled = struct.unpack('>H', data_bytes[:2])[0]
-            tank_level = level_scaled / 100.0
-            return tank_level
-        else:
+        # Invalid characters are discarded, so check we still got 2 bytes
+        if len(head) < 2:
             return None
+        
+        # Big-endian unsigned short
+        return int.from_bytes(head[:2], 'big') / 100.0
     except Exception as e:
-        print(f"Error decoding payload: {e}")
+        logger.error(f"Error decoding payload: {e}")
         return None
 
+def on_socket_open(client, userdata, sock):
+    """Tune every new MQTT socket, including those opened on reconnect"""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, MQTT_RCVBUF)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
 def on_connect(client, userdata, flags, rc):
     """Callback when connected to MQTT broker"""
     if rc == 0:
@@ -58,7 +120,7 @@ def on_connect(client, userdata, flags, rc):
         print(f"Subscribing to: {MQTT_TOPIC}")
         print("=" * 60)
         print()
-        client.subscribe(MQTT_TOPIC)
+        client.subscribe(MQTT_TOPIC, qos=0)
         print("Waiting for water tank data...")
         print()
     else:
@@ -68,48 +130,30 @@ def on_message(client, userdata, msg):
     """Callback when message received"""
     try:
         # Parse JSON payload
-        payload = json.loads(msg.payload.decode())
+        uplink = _DEC.decode(msg.payload)
         
         # Extract device information
-        dev_eui = payload.get('devEUI', payload.get('deviceInfo', {}).get('devEui', 'Unknown'))
-        dev_eui_lower = dev_eui.lower()
-        
-        # Only process messages from our water tank sensor
-        if dev_eui_lower != DEVICE_EUI:
-            return
+        dev_eui = uplink.devEUI or uplink.deviceInfo.devEui or 'Unknown'
         
         # Extract data
-        data_hex = payload.get('data', '')
-        f_port = payload.get('fPort', 'N/A')
-        f_cnt = payload.get('fCnt', 'N/A')
-        rssi = payload.get('rxInfo', [{}])[0].get('rssi', 'N/A') if payload.get('rxInfo') else 'N/A'
-        snr = payload.get('rxInfo', [{}])[0].get('snr', 'N/A') if payload.get('rxInfo') else 'N/A'
+        data_hex = uplink.data
+        f_port = uplink.fPort if uplink.fPort is not None else 'N/A'
+        f_cnt = uplink.fCnt if uplink.fCnt is not None else 'N/A'
+        rx_info = uplink.rxInfo[0] if uplink.rxInfo else RxInfo()
+        rssi = rx_info.rssi if rx_info.rssi is not None else 'N/A'
+        snr = rx_info.snr if rx_info.snr is not None else 'N/A'
         
         # Get timestamp
-        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
         
         # Decode the payload
         tank_level = decode_payload(data_hex)
         
-        # Display results
-        print("=" * 60)
-        print(f"📡 WATER TANK DATA RECEIVED - {timestamp}")
-        print("=" * 60)
-        print(f"Device EUI    : {dev_eui}")
-        print(f"Frame Counter : {f_cnt}")
-        print(f"Port          : {f_port}")
-        print(f"Raw Data (hex): {data_hex}")
-        print("-" * 60)
-        
         if tank_level is not None:
-            # Display tank level with visual indicator
-            print(f"💧 TANK LEVEL : {tank_level:.1f}%")
-            
             # Visual bar
             bar_length = 40
             filled = int((tank_level / 100.0) * bar_length)
             bar = "█" * filled + "░" * (bar_length - filled)
-            print(f"   [{bar}]")
             
             # Status indicator
             if tank_level > 75:
@@ -121,45 +165,93 @@ def on_message(client, userdata, msg):
             else:
                 status = "🔴 CRITICAL - Refill immediately!"
             
-            print(f"   {status}")
+            # Display tank level with visual indicator
+            level_block = (
+                f"💧 TANK LEVEL : {tank_level:.1f}%\n"
+                f"   [{bar}]\n"
+                f"   {status}"
+            )
         else:
-            print("❌ ERROR: Could not decode tank level")
+            level_block = "❌ ERROR: Could not decode tank level"
         
-        print("-" * 60)
-        print(f"Signal RSSI   : {rssi} dBm")
-        print(f"Signal SNR    : {snr} dB")
-        print("=" * 60)
-        print()
+        # Display results as a single write
+        logger.info(
+            f"{_SEP}\n"
+            f"📡 WATER TANK DATA RECEIVED - {timestamp}\n"
+            f"{_SEP}\n"
+            f"Device EUI    : {dev_eui}\n"
+            f"Frame Counter : {f_cnt}\n"
+            f"Port          : {f_port}\n"
+            f"Raw Data (hex): {data_hex}\n"
+            f"{_RULE}\n"
+            f"{level_block}\n"
+            f"{_RULE}\n"
+            f"Signal RSSI   : {rssi} dBm\n"
+            f"Signal SNR    : {snr} dB\n"
+            f"{_SEP}\n"
+        )
         
         # Log to file (optional)
         log_to_file(timestamp, tank_level, f_cnt, rssi, snr)
         
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON: {e}")
+    except msgspec.DecodeError as e:
+        logger.error(f"Error parsing JSON: {e}")
     except Exception as e:
-        print(f"Error processing message: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error processing message: {e}")
+
+def _open_log():
+    """Open the CSV log for appending, writing the header if it is empty"""
+    global _log_fh
+    if _log_fh is None:
+        _log_fh = open(LOG_FILE, 'a')
+        if _log_fh.tell() == 0:
+            _log_fh.write("timestamp,tank_level_percent,frame_count,rssi_dbm,snr_db\n")
+    return _log_fh
+
+def _flush_log():
+    """Flush buffered log lines to disk"""
+    global _log_pending, _log_timer
+    with _log_lock:
+        _log_timer = None
+        if _log_fh is not None and _log_pending:
+            _log_fh.flush()
+            _log_pending = 0
+
+def _close_log():
+    """Flush and close the log file at exit"""
+    global _log_fh
+    if _log_timer is not None:
+        _log_timer.cancel()
+    _flush_log()
+    with _log_lock:
+        if _log_fh is not None:
+            _log_fh.close()
+            _log_fh = None
+
+atexit.register(_close_log)
 
 def log_to_file(timestamp, tank_level, frame_count, rssi, snr):
     """Append data to CSV log file"""
+    global _log_pending, _log_timer
     if tank_level is None:
         return  # Don't log invalid data
         
     try:
-        log_file = '/home/glen/water_tank_log.csv'
-        
-        # Check if file exists and is empty
-        import os
-        write_header = not os.path.exists(log_file) or os.stat(log_file).st_size == 0
-        
-        with open(log_file, 'a') as f:
-            if write_header:
-                f.write("timestamp,tank_level_percent,frame_count,rssi_dbm,snr_db\n")
-            
+        with _log_lock:
+            f = _open_log()
             f.write(f"{timestamp},{tank_level:.2f},{frame_count},{rssi},{snr}\n")
+            _log_pending += 1
+            
+            if _log_pending >= LOG_FLUSH_EVERY:
+                f.flush()
+                _log_pending = 0
+            elif _log_timer is None:
+                # Make sure the line reaches disk within LOG_FLUSH_INTERVAL
+                _log_timer = threading.Timer(LOG_FLUSH_INTERVAL, _flush_log)
+                _log_timer.daemon = True
+                _log_timer.start()
     except Exception as e:
-        print(f"Warning: Could not write to log file: {e}")
+        logger.warning(f"Warning: Could not write to log file: {e}")
 
 def main():
     """Main function"""
@@ -172,8 +264,12 @@ def main():
     ╚════════════════════════════════════════════════════════════╝
     """)
     
+    _console_listener.start()
+    atexit.register(_console_listener.stop)
+    
     # Create MQTT client
     client = mqtt.Client(client_id="water_tank_monitor")
+    client.on_socket_open = on_socket_open
     client.on_connect = on_connect
     client.on_message = on_message
     